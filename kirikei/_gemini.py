@@ -0,0 +1,33 @@
+import os
+import functools
+
+from dotenv import load_dotenv
+from google import genai
+
+@functools.lru_cache(maxsize=1)
+def _api_key() -> str | None:
+  """Gemini APIのAPIキーを取得する関数
+  .envファイルの読み込みは初回呼び出し時に一度だけ行います。
+  """
+  # .envファイルの読み込み
+  load_dotenv()
+  return os.getenv('GEMINI_API_KEY')
+
+def create_client() -> genai.Client:
+  """Gemini APIのクライアントを新しく作成する関数
+  非同期クライアント（client.aio）はコネクションを作成したイベントループに紐づくため、
+  asyncio.runごとにこの関数で作成し、ループの終了前にclient.aio.aclose()で閉じてください。
+  Returns:
+    genai.Client: Gemini APIのクライアント
+  """
+  return genai.Client(api_key=_api_key())
+
+@functools.lru_cache(maxsize=1)
+def get_client() -> genai.Client:
+  """同期呼び出し用のGemini APIのクライアントを取得する関数
+  クライアントの作成は初回呼び出し時に一度だけ行い、以降は同じクライアントを使い回します。
+  複数のイベントループをまたいで使うことになるため、client.aioには使用しないでください。
+  Returns:
+    genai.Client: Gemini APIのクライアント
+  """
+  return create_client()
@@ -0,0 +1,187 @@
+import os
+import asyncio
+import hashlib
+import sqlite3
+import typing
+import functools
+from contextlib import closing
+
+from pydantic import TypeAdapter
+
+from _gemini import create_client
+
+# キャッシュの保存先
+CACHE_PATH = os.path.join('data', 'llm_cache.sqlite')
+
+def _schema_name(schema) -> str:
+  """response_schemaからキャッシュキー用の名前を作成する関数
+  list[ServiceDetail]のようなジェネリック型は__name__が'list'になってしまうため、
+  型引数も含めた名前を作成します。
+  """
+  args = typing.get_args(schema)
+  if args:
+    return f"{typing.get_origin(schema).__name__}[{', '.join(_schema_name(a) for a in args)}]"
+  return schema.__name__
+
+def _cache_key(model: str, contents: str, schema) -> str:
+  """モデル名、プロンプト、スキーマ名からキャッシュキーを作成する関数"""
+  return hashlib.sha256(f"{model}\0{contents}\0{_schema_name(schema)}".encode()).hexdigest()
+
+def _connect() -> sqlite3.Connection:
+  """キャッシュ用のSQLiteデータベースに接続する関数"""
+  os.makedirs(os.path.dirname(CACHE_PATH), exist_ok=True)
+  conn = sqlite3.connect(CACHE_PATH)
+  conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, response TEXT NOT NULL)")
+  return conn
+
+def _config(schema) -> dict:
+  """Gemini APIに渡す設定を作成する関数"""
+  return {
+    "temperature": 0, # 出力の多様性を制御するための温度パラメータ
+    "response_mime_type": "application/json", # レスポンスのMIMEタイプをJSONに設定
+    "response_schema": schema, # Pydanticモデルを使用してレスポンスを定義
+  }
+
+def _cache_disabled() -> bool:
+  """環境変数LLM_CACHE_DISABLEDでキャッシュの読み込みが無効化されているかを判定する関数
+  LLM_CACHE_DISABLED=0のように無効化しない値も設定できるよう、明示的な値のみを有効とします。
+  """
+  return os.getenv('LLM_CACHE_DISABLED', '').strip().lower() in {'1', 'true', 'yes', 'on'}
+
+def _lookup(conn: sqlite3.Connection, key: str) -> str | None:
+  """キャッシュからレスポンスを取得する関数
+  キャッシュの読み込みが無効化されている場合は常にNoneを返します。
+  """
+  if _cache_disabled():
+    return None
+  row = conn.execute("SELECT response FROM llm_cache WHERE key = ?", (key,)).fetchone()
+  return row[0] if row is not None else None
+
+@functools.lru_cache
+def _adapter(schema) -> TypeAdapter:
+  """スキーマごとのTypeAdapterを取得する関数"""
+  return TypeAdapter(schema)
+
+def _validate(response_text: str | None, schema) -> str:
+  """レスポンスがスキーマを満たすかを検証する関数
+  途中で切れたレスポンスやブロックされた空のレスポンスをキャッシュしないよう、
+  保存前に検証します。
+
+  Raises:
+    ValueError: レスポンスが空の場合
+    pydantic.ValidationError: レスポンスがスキーマを満たさない場合
+  """
+  if response_text is None:
+    raise ValueError("Gemini APIのレスポンスが空です。")
+  _adapter(schema).validate_json(response_text)
+  return response_text
+
+def _store(conn: sqlite3.Connection, key: str, response_text: str) -> None:
+  """レスポンスをキャッシュに保存する関数"""
+  with conn:
+    conn.execute("INSERT OR REPLACE INTO llm_cache (key, response) VALUES (?, ?)", (key, response_text))
+
+def cached_generate(client, model: str, contents: str, schema) -> str:
+  """キャッシュを利用してGemini APIからレスポンスを取得する関数
+  この関数は、temperature=0で呼び出したGemini APIのレスポンスをSQLiteにキャッシュし、
+  同じモデル・プロンプト・スキーマの組み合わせではキャッシュ済みのレスポンスを返します。
+  環境変数LLM_CACHE_DISABLEDが1またはtrueの場合はキャッシュを読まずにAPIを呼び出します。
+  スキーマを満たさないレスポンスはキャッシュせずに例外を送出します。
+
+  Args:
+    client (genai.Client): Gemini APIのクライアント
+    model (str): モデル名
+    contents (str): プロンプト
+    schema: レスポンスを定義するPydanticモデル
+
+  Returns:
+    str: レスポンスのJSON文字列
+  """
+  key = _cache_key(model, contents, schema)
+  with closing(_connect()) as conn:
+    response_text = _lookup(conn, key)
+    if response_text is None:
+      response = client.models.generate_content(model=model, contents=contents, config=_config(schema))
+      response_text = _validate(response.text, schema)
+      _store(conn, key, response_text)
+
+  return response_text
+
+def estimate_tokens(prompt: str) -> int:
+  """プロンプトのトークン数を概算する関数
+  UTF-8のバイト数を3で割った値を用います。日本語はほぼ1文字1トークン、
+  英数字は多めに見積もられるため、APIを呼ばずに安全側の見積もりができます。
+  """
+  return len(prompt.encode('utf-8')) // 3
+
+def _render_chunks(chunk: list, prompt_for, max_prompt_tokens: int) -> list[str]:
+  """チャンクのプロンプトを作成する関数
+  プロンプトがmax_prompt_tokensを超える場合は、チャンクを半分に分割して作成し直します。
+  """
+  prompt = prompt_for(chunk)
+  if len(chunk) <= 1 or estimate_tokens(prompt) <= max_prompt_tokens:
+    return [prompt]
+  mid = len(chunk) // 2
+  return _render_chunks(chunk[:mid], prompt_for, max_prompt_tokens) + _render_chunks(chunk[mid:], prompt_for, max_prompt_tokens)
+
+def generate_in_chunks(model: str, items: list, prompt_for, schema,
+                       chunk_size: int = 5, concurrency: int = 8, max_prompt_tokens: int = 28000) -> list[str]:
+  """リストをチャンクに分割し、Gemini APIへ並列にリクエストする関数
+  この関数は、itemsをchunk_size件ずつに分割し、チャンクごとのプロンプトを
+  asyncio.gatherで同時に送信します。同時実行数はconcurrencyで制限します。
+  プロンプトの推定トークン数がmax_prompt_tokensを超えるチャンクはさらに分割します。
+  非同期クライアントはイベントループをまたいで使えないため、呼び出しごとに作成して閉じます。
+  キャッシュの読み書きはイベントループを止めないよう、送信前と送信後にまとめて1つの接続で行います。
+
+  Args:
+    model (str): モデル名
+    items (list): プロンプトに含める要素のリスト
+    prompt_for (Callable[[list], str]): チャンクからプロンプトを作成する関数
+    schema: レスポンスを定義するPydanticモデル
+    chunk_size (int): 1リクエストあたりの要素数
+    concurrency (int): 同時に送信するリクエストの最大数
+    max_prompt_tokens (int): 1リクエストあたりのプロンプトの推定トークン数の上限
+
+  Returns:
+    list[str]: チャンクごとのレスポンスのJSON文字列（チャンクの順序を保持）
+  """
+  # チャンクごとのプロンプトを送信前にまとめて作成する
+  prompts = [
+    prompt
+    for i in range(0, len(items), chunk_size)
+    for prompt in _render_chunks(items[i:i + chunk_size], prompt_for, max_prompt_tokens)
+  ]
+  keys = [_cache_key(model, prompt, schema) for prompt in prompts]
+
+  async def _generate_all(missing):
+    semaphore = asyncio.Semaphore(concurrency)
+    client = create_client()
+
+    async def _generate_prompt(prompt):
+      async with semaphore:
+        response = await client.aio.models.generate_content(model=model, contents=prompt, config=_config(schema))
+        return _validate(response.text, schema)
+
+    try:
+      # 失敗したチャンクがあっても、成功したチャンクのレスポンスはキャッシュに保存する
+      return await asyncio.gather(*(_generate_prompt(prompts[i]) for i in missing), return_exceptions=True)
+    finally:
+      # このイベントループで作成したコネクションをループの終了前に閉じる
+      await client.aio.aclose()
+
+  with closing(_connect()) as conn:
+    response_texts = [_lookup(conn, key) for key in keys]
+    missing = [i for i, response_text in enumerate(response_texts) if response_text is None]
+    if not missing:
+      return response_texts
+
+    results = asyncio.run(_generate_all(missing))
+    for i, result in zip(missing, results):
+      if not isinstance(result, BaseException):
+        _store(conn, keys[i], result)
+        response_texts[i] = result
+
+  for result in results:
+    if isinstance(result, BaseException):
+      raise result
+  return response_texts
@@ -1,15 +1,17 @@
-import os
-import json
+from collections.abc import Iterable
 
-from dotenv import load_dotenv
-from google import genai
-from pydantic import BaseModel
+import jinja2
+from pydantic import BaseModel, TypeAdapter
 
+import matplotlib
+# GUIバックエンドを読み込まず、PNGファイルへの保存のみを行う
+matplotlib.use('Agg')
 import matplotlib.pyplot as plt
 import matplotlib_venn as venn
 
 import scrape
 import search
+from llm_cache import generate_in_chunks
 
 class Service(BaseModel):
   """サービス情報を表すモデル
@@ -23,59 +25,52 @@ class Service(BaseModel):
   
   service_name: str
   know: bool = False
+
+# レスポンスのJSON文字列を直接検証・変換するためのアダプタ
+_SERVICE_ADAPTER = TypeAdapter(list[Service])
+
+# プロンプトのテンプレート（モジュール読み込み時に一度だけコンパイルする）
+# 日本語で指定しないと英語で回答される
+_RECALL_PROMPT = jinja2.Template("以下のBIツールを知っていますか？\n{{ names | join(', ') }}\n\nそれぞれのBIツールについて、知っている場合はTrue、知らない場合はFalseで答えてください。ただし、回答は日本語で行ってください。Web検索は使用せず、あなたが知っている情報に基づいて回答してください。")
  
 def get_services_from_gemini(services_list):
   """Gemini APIを使用してBIツールの情報を取得する関数
   この関数は、Gemini APIを使用して、services_listに含まれるBIツールを知っているかどうかを確認します。
   Returns:
-    list[Dict]: サービスのリスト
+    list[Service]: サービスのリスト
   """
   # https://zenn.dev/peishim/articles/2e2e8408888f59
   # https://ai.google.dev/gemini-api/docs/text-generation?hl=ja
   
-  # .envファイルの読み込み
-  load_dotenv()
-  
-  # API-KEYの設定
-  GOOGLE_API_KEY=os.getenv('GEMINI_API_KEY')
-  client = genai.Client(api_key=GOOGLE_API_KEY)
-  
-  # Gemini APIを使用してBIツールの情報を取得
-  response = client.models.generate_content(
+  # Gemini APIを使用してBIツールの情報を取得（キャッシュがあればそれを使用）
+  # サービスを5件ずつのチャンクに分割して並列にリクエストする
+  response_texts = generate_in_chunks(
     model="gemini-2.0-flash",
-    contents=f"以下のBIツールを知っていますか？\n{', '.join(services_list)}\n\nそれぞれのBIツールについて、知っている場合はTrue、知らない場合はFalseで答えてください。ただし、回答は日本語で行ってください。Web検索は使用せず、あなたが知っている情報に基づいて回答してください。", 
-    # 日本語で指定しないと英語で回答される
-    config={
-      "temperature": 0, # 出力の多様性を制御するための温度パラメータ
-      "response_mime_type": "application/json", # レスポンスのMIMEタイプをJSONに設定
-      "response_schema": list[Service], # Pydanticモデルを使用してレスポンスを定義
-    }
+    items=services_list,
+    prompt_for=lambda chunk: _RECALL_PROMPT.render(names=chunk),
+    schema=list[Service], # Pydanticモデルを使用してレスポンスを定義
   )
-  # レスポンスの文字列をlist[dict]型に変換
-  response = json.loads(response.text)
+  # チャンクごとのレスポンスの文字列をlist[Service]型に変換して結合
+  response = [item for response_text in response_texts for item in _SERVICE_ADAPTER.validate_json(response_text)]
 
-  # レスポンスをパースしてサービスのリストを作成
-  service_know_gemini = []
-  for item in response:
-    if item['service_name'] and item['know'] is not None:
-      service_know_gemini.append(dict(service_name=item['service_name'], know=item['know']))
+  # サービス名が空のものを除外してサービスのリストを作成
+  service_know_gemini = [item for item in response if item.service_name]
 
   return service_know_gemini
 
 
-def check_services_in_search(services_list: list, search_results: list) -> list[Service]:
+def check_services_in_search(services_list: list, search_results: Iterable[dict]) -> list[Service]:
   """Google Custom Search APIの結果からBIツールの情報を確認する関数
   この関数は、Google Custom Search APIの結果から、services_listに含まれるBIツールの情報を確認します。
+  search_resultsは一度しか走査しないため、ストリーミングで読み込んだイテレータも渡せます。
   Returns:
     list[Service]: サービスのリスト
   """
-  service_know_search = []
-  
-  for service in services_list:
-    know = any(service.lower() in result['title'].lower() or service.lower() in result['snippet'].lower() for result in search_results)
-    service_know_search.append(dict(service_name=service, know=know))
-  
-  return service_know_search
+  # 検索結果のタイトルとスニペットを一度だけ小文字化して1つの文字列に連結する
+  # 改行で区切ることで、タイトルとスニペットをまたいだ誤検出を防ぐ
+  corpus = '\n'.join(f"{result['title']}\n{result['snippet']}".lower() for result in search_results)
+
+  return [Service(service_name=service, know=service.lower() in corpus) for service in services_list]
 
 if __name__ == "__main__":
   # ITreviewからBIツールの情報を取得する
@@ -86,8 +81,8 @@ if __name__ == "__main__":
   print(service_know_gemini)
   
   # 結果をJSONファイルに保存
-  with open('bi_service_recall_know_gemini.json', 'w', encoding='utf-8') as f:
-    json.dump(service_know_gemini, f, ensure_ascii=False, indent=2)
+  with open('bi_service_recall_know_gemini.json', 'wb') as f:
+    f.write(_SERVICE_ADAPTER.dump_json(service_know_gemini, indent=2))
   
   # Google Custom Search APIを使用してBIツールの公式サイトを検索する
   # 10ページまでの検索結果を取得
@@ -100,8 +95,8 @@ if __name__ == "__main__":
   
   # geminiの結果と検索結果をmatplotlibのベン図で比較する
   # ここではmatplotlibを使用してベン図を描画するコードを追加することができます。
-  set_gemini = set([s['service_name'] for s in service_know_gemini if s['know']])
-  set_search = set([s['service_name'] for s in service_know_search if s['know']])
+  set_gemini = {s.service_name for s in service_know_gemini if s.know}
+  set_search = {s.service_name for s in service_know_search if s.know}
   venn_labels = {
       '10': len(set_gemini - set_search),
       '01': len(set_search - set_gemini),
@@ -112,7 +107,6 @@ if __name__ == "__main__":
   plt.title("Gemini vs Search Results")
   # ベン図をpngファイルとして保存
   plt.savefig('venn_diagram.png', format='png')
-  plt.show()
   
   print('Geiminiのみ知っている', set_gemini - set_search)
   print('検索のみ知っている', set_search - set_gemini)
\ No newline at end of file
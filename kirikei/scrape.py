@@ -1,7 +1,43 @@
 import requests
-import json
+import orjson
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
 
-from bs4 import BeautifulSoup
+from selectolax.lexbor import LexborHTMLParser
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception
+
+def _is_transient(e: BaseException) -> bool:
+  """再試行すべき一時的なエラーかどうかを判定する関数
+  接続エラー、タイムアウト、5xx、429のみを再試行し、404などの4xxは再試行しません。
+  """
+  if isinstance(e, requests.HTTPError):
+    return e.response is not None and (e.response.status_code >= 500 or e.response.status_code == 429)
+  return isinstance(e, (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError))
+
+@retry(
+  stop=stop_after_attempt(4),
+  wait=wait_exponential(multiplier=0.5, max=8),
+  retry=retry_if_exception(_is_transient),
+  reraise=True,
+)
+def _get(session: requests.Session, url: str) -> str:
+  """ページを取得する関数
+  一時的なエラーの場合は指数バックオフで最大4回まで試行します。
+  """
+  page = session.get(url, timeout=10)
+  page.raise_for_status()
+  return page.text
+
+def normalize_service_list(service_list: list) -> list:
+  """サービス名のリストを正規化する関数
+  この関数は、各サービス名をNFKC正規化して前後の空白を除去し、
+  出現順を保ったまま重複を取り除きます。
+  Args:
+      service_list (list): サービス名のリスト
+  Returns:
+      list: 正規化・重複除去したサービス名のリスト
+  """
+  return list(dict.fromkeys(unicodedata.normalize('NFKC', s).strip() for s in service_list))
 
 def get_bi_service_list(forced=False) -> list:
   """BIツールのサービス名を取得する関数
@@ -28,42 +64,48 @@ def get_bi_service_list(forced=False) -> list:
   
   if forced:
     print('サービス名を強制的に取得します。')
-    # 1ページ目か15ページ目までのサービスを取得
-    for i in range(1, 15):
+    # 1ページ目か15ページ目までのページを並列に取得
+    # 1つのセッションでコネクションを使い回す
+    with requests.Session() as session, ThreadPoolExecutor(max_workers=8) as executor:
+      pages = [executor.submit(_get, session, URL.format(i)) for i in range(1, 15)]
+
+    for i, page in enumerate(pages, start=1):
       try: 
-        page = requests.get(URL.format(i))
         # htmlをパース
-        soup = BeautifulSoup(page.text, 'html.parser')
-        # サービス名を含む要素を取得
-        # class名が'product-card'のdiv要素を全て取得
-        product_cards = soup.find_all('div', {'class':'product-card'})
-        
-        # 各サービス名をリストに追加
-        for p in product_cards:
-          service_name = p.find('a', text=True).string
-          
-          # かっこ書きのサービス名は除外
-          if '（' in service_name:
-            service_name = service_name.split('（')[0].strip()
-
-          service_list.append(service_name)
-        
-          
-      except Exception as e:
-        print(f"Error occurred while processing page {i}.")
+        tree = LexborHTMLParser(page.result())
+      except requests.RequestException as e:
+        print(f"Error occurred while processing page {i}: {e}")
         # エラーが発生した場合はループを抜ける
         break
+
+      # サービス名を含む要素を取得
+      # class名が'product-card'のdiv要素を全て取得
+      for card in tree.css('div.product-card'):
+        # テキストを持つ最初のa要素をサービス名とする
+        # text(strip=True)はテキストノードを空白なしで連結するため、連結してから前後の空白を除去する
+        service_name = next((name for a in card.css('a') if (name := a.text().strip())), None)
+        if service_name is None:
+          continue
+
+        # かっこ書きのサービス名は除外
+        if '（' in service_name:
+          service_name = service_name.split('（')[0].strip()
+
+        service_list.append(service_name)
+
+    # ページ間で重複したサービス名を取り除く
+    service_list = normalize_service_list(service_list)
     
     # jsonファイルに保存
-    with open('bi_services.json', 'w', encoding='utf-8') as f:
-      json.dump(service_list, f, ensure_ascii=False, indent=2)
+    with open('bi_services.json', 'wb') as f:
+      f.write(orjson.dumps(service_list, option=orjson.OPT_INDENT_2))
       
   else:
     print('サービス名を既存のJSONファイルから取得します。')
     # 既存のJSONファイルからサービス名を取得
     try:
-      with open('bi_services.json', 'r', encoding='utf-8') as f:
-        service_list = json.load(f)
+      with open('bi_services.json', 'rb') as f:
+        service_list = normalize_service_list(orjson.loads(f.read()))
     except FileNotFoundError:
       print('bi_services.jsonが見つかりません。Webから取得します。')
       return get_bi_service_list(forced=True)
@@ -1,8 +1,62 @@
-import requests
-import json
+import asyncio
+import httpx
 import os
+import functools
+import itertools
+import ijson
+import orjson
 
 from dotenv import load_dotenv
+from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception
+
+# このサイズを超えるキャッシュファイルはストリーミングで読み込む
+STREAMING_THRESHOLD = 10 * 1024 * 1024
+
+@functools.lru_cache(maxsize=1)
+def get_api_keys() -> tuple[str | None, str | None]:
+  """Google Custom Search APIのAPIキーと検索エンジンIDを取得する関数
+  .envファイルの読み込みは初回呼び出し時に一度だけ行います。
+  Returns:
+      tuple[str | None, str | None]: APIキーと検索エンジンIDの組
+  """
+  load_dotenv()  # .envファイルの読み込み
+  return os.getenv('CUSTOM_SEARCH_API_KEY'), os.getenv('CX_ID_KEY')
+
+def _is_transient(e: BaseException) -> bool:
+  """再試行すべき一時的なエラーかどうかを判定する関数
+  接続エラー、タイムアウト、5xx、429のみを再試行し、APIキーの誤り(400)や
+  クォータ超過(403)などの4xxは再試行しません。
+  """
+  if isinstance(e, httpx.HTTPStatusError):
+    return e.response.status_code >= 500 or e.response.status_code == 429
+  return isinstance(e, httpx.TransportError)
+
+@retry(
+  stop=stop_after_attempt(4),
+  wait=wait_exponential(multiplier=0.5, max=8),
+  retry=retry_if_exception(_is_transient),
+  reraise=True,
+)
+async def _fetch_page(client: httpx.AsyncClient, base_url: str, params: dict) -> dict:
+  """検索結果の1ページ分を取得する関数
+  一時的なエラーの場合は指数バックオフで最大4回まで試行します。
+  """
+  response = await client.get(base_url, params=params)
+  response.raise_for_status()  # HTTPエラーがあれば例外を発生させる
+  # バイト列を直接パースし、文字列へのデコードを省略する
+  return orjson.loads(response.content)
+
+async def _fetch_pages(base_url: str, params_list: list[dict]) -> list:
+  """検索結果の全ページを並列に取得する関数
+  HTTP/2で1つのコネクションを多重化して全ページを同時にリクエストします。
+  Returns:
+      list: ページごとのレスポンス。失敗したページは発生した例外が入ります。
+  """
+  async with httpx.AsyncClient(http2=True, timeout=10) as client:
+    return await asyncio.gather(
+      *(_fetch_page(client, base_url, params) for params in params_list),
+      return_exceptions=True,
+    )
 
 def get_google_search_results(query: str, num_results: int = 100, forced: bool = False) -> list:
   """
@@ -21,10 +75,8 @@ def get_google_search_results(query: str, num_results: int = 100, forced: bool =
     print("Error: num_results must be between 1 and 100.")
     return []
 
-  load_dotenv()  # .envファイルの読み込み
   # API-KEYの設定
-  GOOGLE_API_KEY=os.getenv('CUSTOM_SEARCH_API_KEY')
-  GOOGLE_CX_ID=os.getenv('CX_ID_KEY')
+  GOOGLE_API_KEY, GOOGLE_CX_ID = get_api_keys()
 
   base_url = "https://www.googleapis.com/customsearch/v1"
   results = []
@@ -34,20 +86,25 @@ def get_google_search_results(query: str, num_results: int = 100, forced: bool =
     # Google Custom Search APIは1リクエストあたり最大10件の結果しか返さないため、
     # 100件取得するには複数回リクエストを送信する必要があります。
     # startパラメータで開始位置を指定します。
-    for i in range(0, num_results, 10):
-      start_index = i + 1
-      params = {
+    params_list = [
+      {
         "key": GOOGLE_API_KEY,
         "cx": GOOGLE_CX_ID,
         "q": query,
-        "start": start_index,
+        "start": i + 1,
         "num": min(10, num_results - i)  # 残りの件数を考慮して取得する件数を調整
       }
+      for i in range(0, num_results, 10)
+    ]
+    # 全ページを並列に取得し、ページ順に結果を処理する
+    pages = asyncio.run(_fetch_pages(base_url, params_list))
+
+    for params, data in zip(params_list, pages):
+      start_index = params["start"]
 
       try:
-        response = requests.get(base_url, params=params)
-        response.raise_for_status()  # HTTPエラーがあれば例外を発生させる
-        data = response.json()
+        if isinstance(data, Exception):
+          raise data  # 取得時に発生した例外をここで処理する
 
         if "items" in data:
           results.extend(data["items"])
@@ -55,30 +112,32 @@ def get_google_search_results(query: str, num_results: int = 100, forced: bool =
           print(f"No more results found or 'items' not in response at start_index {start_index}.")
           break # 'items'がない場合はそれ以上結果がないと判断
 
-      except requests.exceptions.RequestException as e:
+      except httpx.HTTPError as e:
         print(f"Request failed: {e}")
         break
-      except json.JSONDecodeError as e:
+      except orjson.JSONDecodeError as e:
         print(f"JSON decoding failed: {e}")
         break
-      except Exception as e:
-        print(f"An unexpected error occurred: {e}")
-        break
 
       # 取得したい件数に達したら終了
       if len(results) >= num_results:
         break
     
     #結果をjsonファイルに保存
-    with open('search_results.json', 'w', encoding='utf-8') as f:
-      json.dump(results, f, ensure_ascii=False, indent=2)
+    with open('search_results.json', 'wb') as f:
+      f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2))
   
   else:
     print('検索結果を既存のJSONファイルから取得します。')
     # 既存のJSONファイルから検索結果を取得
     try:
-      with open('search_results.json', 'r', encoding='utf-8') as f:
-        results = json.load(f)
+      streaming = os.path.getsize('search_results.json') > STREAMING_THRESHOLD
+      with open('search_results.json', 'rb') as f:
+        if streaming:
+          # 大きなファイルは全体を読み込まず、必要な件数だけ逐次パースする
+          results = list(itertools.islice(ijson.items(f, 'item', use_float=True), num_results))
+        else:
+          results = orjson.loads(f.read())
     except FileNotFoundError:
       print('search_results.jsonが見つかりません。Webから取得します。')
       return get_google_search_results(query, num_results, forced=True)
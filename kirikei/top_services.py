@@ -1,12 +1,11 @@
-import os
-import json
+import orjson
 
-from dotenv import load_dotenv
-from google import genai
 from pydantic import BaseModel
 import pandas as pd
 
 import search
+from _gemini import get_client
+from llm_cache import cached_generate
 
 class Service(BaseModel):
   """サービス情報を表すモデル
@@ -26,26 +25,20 @@ def get_services_from_gemini():
   # https://zenn.dev/peishim/articles/2e2e8408888f59
   # https://ai.google.dev/gemini-api/docs/text-generation?hl=ja
   
-  # .envファイルの読み込み
-  load_dotenv()
+  # Gemini APIのクライアントを取得（初回のみ作成）
+  client = get_client()
   
-  # API-KEYの設定
-  GOOGLE_API_KEY=os.getenv('GEMINI_API_KEY')
-  client = genai.Client(api_key=GOOGLE_API_KEY)
-  
-  response = client.models.generate_content(
+  # Gemini APIを使用してBIツールの情報を取得（キャッシュがあればそれを使用）
+  response_text = cached_generate(
+    client,
     model="gemini-2.0-flash",
     contents="日本で利用される典型的なBIツールのトップ10サービスを有名な順にあげなさい。また、回答には説明を含むこと。回答は日本語とすること。さらに、BIツールの選定においてWeb検索は使わず、あなたが知っている情報に基づいて回答すること。", 
     # 日本語で指定しないと英語で回答される
-    config={
-      "temperature": 0, # 出力の多様性を制御するための温度パラメータ
-      "response_mime_type": "application/json", # レスポンスのMIMEタイプをJSONに設定
-      "response_schema": list[Service], # Pydanticモデルを使用してレスポンスを定義
-    }
+    schema=list[Service], # Pydanticモデルを使用してレスポンスを定義
   )
   
   # レスポンスの文字列をlist[dict]型に変換
-  response = json.loads(response.text)
+  response = orjson.loads(response_text)
   
   return response
 
@@ -60,8 +53,8 @@ if __name__ == "__main__":
     search_query, num_results=num_to_fetch)
 
   # geminiとsearchの結果を表にして並べて表示する
-  df_gemini = pd.DataFrame([s['service_name'] for s in gemini_result], columns=['gemini'])
-  df_search = pd.DataFrame([s['title'] for s in search_results], columns=['search'])
+  df_gemini = pd.DataFrame.from_records(gemini_result, columns=['service_name']).rename(columns={'service_name': 'gemini'})
+  df_search = pd.DataFrame.from_records(search_results, columns=['title']).rename(columns={'title': 'search'})
 
   df = pd.concat([df_gemini, df_search], axis=1)
   print(df)
\ No newline at end of file